@@ -4,16 +4,18 @@ Modbus TCP server script for debugging
 Author: Michael Oberdorf IT-Consulting
 Datum: 2020-03-30
 Last modified by: Michael Oberdorf
-Last modified at: 2024-10-22
+Last modified at: 2026-10-15
 *************************************************************************** """
 import argparse
-import json
 import logging
 import os
+import re
 import socket
+import ssl
 import sys
-from typing import Literal, Optional
+from typing import Literal, Optional, Union
 
+from pymodbus import __version__ as pymodbus_version
 from pymodbus.datastore import (
     ModbusSequentialDataBlock,
     ModbusServerContext,
@@ -21,15 +23,49 @@ from pymodbus.datastore import (
     ModbusSparseDataBlock,
 )
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.server.sync import StartTcpServer, StartTlsServer, StartUdpServer
+from pymodbus.server.sync import (
+    ModbusConnectedRequestHandler,
+    StartTcpServer,
+    StartTlsServer,
+    StartUdpServer,
+)
+
+try:
+    # orjson parses large register maps much faster, use it if available
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # default configuration file path
 default_config_file = "/app/modbus_server.json"
 VERSION = "1.4.0"
+# 16 bit register value in hexadecimal notation, e.g. 0x00FF
+HEX_WORD_PATTERN = re.compile(r"0[xX][0-9a-fA-F]{1,4}")
 
 log = logging.getLogger()
 
 
+"""
+###############################################################################
+# C L A S S E S
+###############################################################################
+"""
+
+
+class NoDelayRequestHandler(ModbusConnectedRequestHandler):
+    """
+    Request handler for TCP client connections with Nagle's algorithm disabled,
+    the small Modbus responses are sent immediately instead of waiting for the ACK of the previous segment
+    """
+
+    def setup(self):
+        """
+        Set TCP_NODELAY on the client connection before the pymodbus handler setup
+        """
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+
 """
 ###############################################################################
 # F U N C T I O N S
@@ -44,14 +80,39 @@ def get_ip_address() -> str:
     """
     ipaddr = ""
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ipaddr = s.getsockname()[0]
-    except Exception:
+        # connecting a UDP socket only selects the route, no packet is sent to the network
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            ipaddr = s.getsockname()[0]
+    except OSError:
         pass
     return ipaddr
 
 
+def create_datablock(register: Union[dict, list, None] = None):
+    """
+    Create the modbus datablock for the given register values
+    @param register: dict(), addresses and their values or list(), values of the whole address space (default: None)
+    @return: ModbusSequentialDataBlock if the register covers the whole address space or is empty,
+             ModbusSparseDataBlock otherwise
+    """
+    if isinstance(register, list) and register:
+        log.debug("using register list as sequential datablock")
+        return ModbusSequentialDataBlock(0x00, register)
+
+    if not isinstance(register, dict) or not register:
+        log.debug("set all registers to 0x00")
+        return ModbusSequentialDataBlock.create()
+
+    if len(register) == 65536 and min(register) == 0 and max(register) == 65535:
+        # a sequential datablock is indexed by offset instead of looking up every address in a dictionary
+        log.debug("using dense register map as sequential datablock")
+        return ModbusSequentialDataBlock(0x00, [register[r] for r in range(0, 65536, 1)])
+
+    log.debug("using sparse register map as sparse datablock")
+    return ModbusSparseDataBlock(register)
+
+
 def run_server(
     listener_address: str = "0.0.0.0",
     listener_port: int = 5020,
@@ -59,69 +120,37 @@ def run_server(
     tls_cert: str = None,
     tls_key: str = None,
     zero_mode: bool = False,
-    discrete_inputs: Optional[dict] = None,
-    coils: Optional[dict] = None,
-    holding_registers: Optional[dict] = None,
-    input_registers: Optional[dict] = None,
+    discrete_inputs: Union[dict, list, None] = None,
+    coils: Union[dict, list, None] = None,
+    holding_registers: Union[dict, list, None] = None,
+    input_registers: Union[dict, list, None] = None,
 ):
     """
     Run the modbus server(s)
     @param listener_address: string, IP address to bind the listener (default: '0.0.0.0')
     @param listener_port: integer, TCP port to bin the listener (default: 5020)
     @param protocol: string, defines if the server listenes to TCP or UDP (default: 'TCP')
-    @param tls_cert: boolean, path to certificate to start tcp server with TLS (default: None)
-    @param tls_key: boolean, path to private key to start tcp server with TLS (default: None)
+    @param tls_cert: string, path to certificate to start tcp server with TLS (default: None)
+    @param tls_key: string, path to private key to start tcp server with TLS (default: None)
     @param zero_mode: boolean, request to address(0-7) will map to the address (0-7) instead of (1-8) (default: False)
-    @param discrete_inputs: dict(), initial addresses and their values (default: dict())
-    @param coils: dict(), initial addresses and their values (default: dict())
-    @param holding_registers: dict(), initial addresses and their values (default: dict())
-    @param input_registers: dict(), initial addresses and their values (default: dict())
+    @param discrete_inputs: dict() or list(), initial addresses and their values (default: None)
+    @param coils: dict() or list(), initial addresses and their values (default: None)
+    @param holding_registers: dict() or list(), initial addresses and their values (default: None)
+    @param input_registers: dict() or list(), initial addresses and their values (default: None)
     """
 
     # initialize data store
     log.debug("Initialize discrete input")
-    if isinstance(discrete_inputs, dict) and discrete_inputs:
-        # log.debug('using dictionary from configuration file:')
-        # log.debug(discreteInputs)
-        di = ModbusSparseDataBlock(discrete_inputs)
-    else:
-        # log.debug('set all registers to 0xaa')
-        # di = ModbusSequentialDataBlock(0x00, [0xaa]*65536)
-        log.debug("set all registers to 0x00")
-        di = ModbusSequentialDataBlock.create()
+    di = create_datablock(discrete_inputs)
 
     log.debug("Initialize coils")
-    if isinstance(coils, dict) and coils:
-        # log.debug('using dictionary from configuration file:')
-        # log.debug(coils)
-        co = ModbusSparseDataBlock(coils)
-    else:
-        # log.debug('set all registers to 0xbb')
-        # co = ModbusSequentialDataBlock(0x00, [0xbb]*65536)
-        log.debug("set all registers to 0x00")
-        co = ModbusSequentialDataBlock.create()
+    co = create_datablock(coils)
 
     log.debug("Initialize holding registers")
-    if isinstance(holding_registers, dict) and holding_registers:
-        # log.debug('using dictionary from configuration file:')
-        # log.debug(holdingRegisters)
-        hr = ModbusSparseDataBlock(holding_registers)
-    else:
-        # log.debug('set all registers to 0xcc')
-        # hr = ModbusSequentialDataBlock(0x00, [0xcc]*65536)
-        log.debug("set all registers to 0x00")
-        hr = ModbusSequentialDataBlock.create()
+    hr = create_datablock(holding_registers)
 
     log.debug("Initialize input registers")
-    if isinstance(input_registers, dict) and input_registers:
-        # log.debug('using dictionary from configuration file:')
-        # log.debug(inputRegisters)
-        ir = ModbusSparseDataBlock(input_registers)
-    else:
-        # log.debug('set all registers to 0xdd')
-        # ir = ModbusSequentialDataBlock(0x00, [0xdd]*65536)
-        log.debug("set all registers to 0x00")
-        ir = ModbusSequentialDataBlock.create()
+    ir = create_datablock(input_registers)
 
     store = ModbusSlaveContext(di=di, co=co, hr=hr, ir=ir, zero_mode=zero_mode)
 
@@ -134,13 +163,18 @@ def run_server(
     # If you don't set this or any fields, they are defaulted to empty strings.
     # ----------------------------------------------------------------------- #
     log.debug("Define Modbus server identity")
+    identity_info = {
+        "VendorName": "Pymodbus",
+        "ProductCode": "PM",
+        "VendorUrl": "https://github.com/pymodbus-dev/pymodbus/",
+        "ProductName": "Pymodbus Server",
+        "ModelName": "Pymodbus Server",
+        "MajorMinorRevision": pymodbus_version,
+    }
     identity = ModbusDeviceIdentification()
-    identity.VendorName = "Pymodbus"
-    identity.ProductCode = "PM"
-    identity.VendorUrl = "http://github.com/riptideio/pymodbus/"
-    identity.ProductName = "Pymodbus Server"
-    identity.ModelName = "Pymodbus Server"
-    identity.MajorMinorRevision = "2.5.3"
+    for name, value in identity_info.items():
+        setattr(identity, name, value)
+    log.debug("Modbus server identity: %s", identity_info)
 
     # ----------------------------------------------------------------------- #
     # run the server
@@ -150,36 +184,70 @@ def run_server(
         start_tls = True
 
     if start_tls:
-        log.info(f"Starting Modbus TCP server with TLS on {listener_address}:{listener_port}")
+        log.info("Starting Modbus TCP server with TLS on %s:%s", listener_address, listener_port)
+        # load certificate and key once into a server side context, MODBUS/TCP Security requires TLS 1.2 at least
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        ssl_context.load_cert_chain(certfile=tls_cert, keyfile=tls_key)
         StartTlsServer(
             context,
             identity=identity,
-            certfile=tls_cert,
-            keyfile=tls_key,
+            sslctx=ssl_context,
             address=(listener_address, listener_port),
+            handler=NoDelayRequestHandler,
         )
     else:
-        if protocol == "UDP":
-            log.info(f"Starting Modbus UDP server on {listener_address}:{listener_port}")
+        if protocol.upper() == "UDP":
+            log.info("Starting Modbus UDP server on %s:%s", listener_address, listener_port)
             StartUdpServer(context, identity=identity, address=(listener_address, listener_port))
         else:
-            log.info(f"Starting Modbus TCP server on {listener_address}:{listener_port}")
-            StartTcpServer(context, identity=identity, address=(listener_address, listener_port))
+            log.info("Starting Modbus TCP server on %s:%s", listener_address, listener_port)
+            StartTcpServer(
+                context,
+                identity=identity,
+                address=(listener_address, listener_port),
+                handler=NoDelayRequestHandler,
+            )
             # TCP with different framer
             # StartTcpServer(context, identity=identity, framer=ModbusRtuFramer, address=(listener_address, listener_port))
 
 
+def convert_word_value(val) -> Optional[int]:
+    """
+    Function to convert a register value from the configuration file into a 16 bit word
+    @param val: str() in hexadecimal notation or int(), the configured value
+    @return: int(), the word value or None if the value is malformed or out of range
+    """
+    if isinstance(val, str):
+        return int(val, 16) if HEX_WORD_PATTERN.fullmatch(val) else None
+    if isinstance(val, int) and 0 <= val <= 65535:
+        return val
+    return None
+
+
+def convert_boolean_value(val) -> Optional[bool]:
+    """
+    Function to convert a register value from the configuration file into a single bit
+    @param val: bool() or int(), the configured value
+    @return: bool(), the bit value or None if the value is malformed
+    """
+    if isinstance(val, int):
+        return val != 0
+    return None
+
+
 def prepare_register(
     register: dict,
     init_type: Literal["boolean", "word"],
     initialize_undefined_registers: bool = False,
-) -> dict:
+) -> Union[dict, list]:
     """
     Function to prepare the register to have the correct data types
     @param register: dict(), the register dictionary, loaded from json file
     @param init_type: str(), how to initialize the register values 'boolean' or 'word'
     @param initialize_undefined_registers: boolean, fill undefined registers with 0x00 (default: False)
-    @return: dict(), register with correct data types
+    @return: dict(), register with correct data types,
+             list(), values of the whole address space if initialize_undefined_registers is set
     """
     out_register = dict()
     if not isinstance(register, dict):
@@ -188,57 +256,41 @@ def prepare_register(
     if len(register) == 0:
         return out_register
 
-    for key in register:
-        if isinstance(key, str):
-            key_out = int(key, 0)
-            log.debug(f"  Transform register id: {key} ({type(key)}) to: {key_out} ({type(key_out)})")
-        else:
-            key_out = key
-
-        val = register[key]
-        val_out = val
-        if init_type == "word" and isinstance(val, str) and str(val)[0:2] == "0x" and 3 <= len(val) <= 6:
-            val_out = int(val, 16)
-            log.debug(
-                f"  Transform value for register: {key_out} from: {val} ({type(key)}) to: {val_out} ({type(val_out)})"
-            )
-        elif init_type == "word" and isinstance(val, int) and 0 <= val <= 65535:
-            val_out = val
-            log.debug("  Use value for register: {}: {}".format(str(key_out), str(val_out)))
-        elif init_type == "boolean":
-            if isinstance(val, bool):
-                val_out = val
-                log.debug(f"  Set register: {key_out} to: {val_out} ({type(val_out)})")
-            elif isinstance(val, int):
-                if val == 0:
-                    val_out = False
-                else:
-                    val_out = True
-                log.debug(
-                    f"  Transform value for register: {key_out} from: {val} ({type(key)}) to: "
-                    f"{val_out} ({type(val_out)})"
-                )
-        else:
+    convert = convert_word_value if init_type == "word" else convert_boolean_value
+    for key, val in register.items():
+        key_out = int(key, 0) if isinstance(key, str) else key
+        val_out = convert(val)
+        if val_out is None:
+            # skip the entry, so a malformed alias does not replace a valid value of the same address
             log.error(
-                f"  Malformed input or input is out of range for register: "
-                f"{key_out} -> value is {val} - skip this register initialization!"
+                "  Malformed input or input is out of range for register: "
+                "%s -> value is %s - skip this register initialization!",
+                key_out,
+                val,
             )
             continue
         out_register[key_out] = val_out
 
+    # building the debug messages is expensive for large register maps, so only do it when they are logged
+    if log.isEnabledFor(logging.DEBUG):
+        for key, val in out_register.items():
+            log.debug("  Set register: %s to: %s (%s)", key, val, type(val))
+
     if initialize_undefined_registers:
         if init_type == "word":
             log.debug("  Fill undefined registers with 0x00")
-        elif init_type == "boolean":
+            default_value = 0
+        else:
             log.debug("  Fill undefined registers with False")
-        for r in range(0, 65536, 1):
-            if r not in out_register:
-                if init_type == "word":
-                    # log.debug('  Initialize address: ' + str(r) + ' with 0')
-                    out_register[r] = 0
-                elif init_type == "boolean":
-                    # log.debug('  Initialize address: ' + str(r) + ' with False')
-                    out_register[r] = False
+            default_value = False
+        # the complete address space is a flat list indexed by address
+        full_register = [default_value] * 65536
+        for key_out, val_out in out_register.items():
+            if 0 <= key_out <= 65535:
+                full_register[key_out] = val_out
+            else:
+                log.error("  Register address %s is out of range - skip this register initialization!", key_out)
+        out_register = full_register
 
     return out_register
 
@@ -260,73 +312,67 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
-    if "CONFIG_FILE" in os.environ:
-        config_file = os.environ["CONFIG_FILE"]
-    else:  # will either use the command line argument or the default value
-        config_file = args.config_file
-    # check if file actually exists
-    if not os.path.isfile(config_file):
+    # the environment variable has precedence over the command line argument or the default value
+    config_file = os.environ.get("CONFIG_FILE", args.config_file)
+
+    # read configuration file
+    try:
+        with open(config_file, "rb") as f:
+            CONFIG = json_loads(f.read())
+    except (FileNotFoundError, IsADirectoryError):
         print(f"ERROR: configuration file '{config_file}' does not exist.")
         sys.exit(1)
 
-    # read configuration file
-    with open(config_file, encoding="utf-8") as f:
-        CONFIG = json.load(f)
+    server_config = CONFIG["server"]
+    register_config = CONFIG["registers"]
+    initialize_undefined_registers = register_config["initializeUndefinedRegisters"]
 
     # Initialize logger
-    if CONFIG["server"]["logging"]["logLevel"].lower() == "debug":
-        log.setLevel(logging.DEBUG)
-    elif CONFIG["server"]["logging"]["logLevel"].lower() == "info":
-        log.setLevel(logging.INFO)
-    elif CONFIG["server"]["logging"]["logLevel"].lower() == "warn":
-        log.setLevel(logging.WARN)
-    elif CONFIG["server"]["logging"]["logLevel"].lower() == "error":
-        log.setLevel(logging.ERROR)
-    else:
-        log.setLevel(logging.INFO)
-    logging.basicConfig(format=CONFIG["server"]["logging"]["format"])
+    logging.basicConfig(format=server_config["logging"]["format"])
+    log_levels = {"debug": logging.DEBUG, "info": logging.INFO, "warn": logging.WARN, "error": logging.ERROR}
+    log.setLevel(log_levels.get(server_config["logging"]["logLevel"].lower(), logging.INFO))
 
     # start the server
-    log.info(f"Starting Modbus Server, v{VERSION}")
-    log.debug(f"Loaded successfully the configuration file: {config_file}")
+    log.info("Starting Modbus Server, v%s", VERSION)
+    log.debug("Loaded successfully the configuration file: %s", config_file)
 
     # be sure the data types within the dictionaries are correct (json will only allow strings as keys)
     configured_discrete_inputs = prepare_register(
-        register=CONFIG["registers"]["discreteInput"],
+        register=register_config["discreteInput"],
         init_type="boolean",
-        initialize_undefined_registers=CONFIG["registers"]["initializeUndefinedRegisters"],
+        initialize_undefined_registers=initialize_undefined_registers,
     )
     configured_coils = prepare_register(
-        register=CONFIG["registers"]["coils"],
+        register=register_config["coils"],
         init_type="boolean",
-        initialize_undefined_registers=CONFIG["registers"]["initializeUndefinedRegisters"],
+        initialize_undefined_registers=initialize_undefined_registers,
     )
     configured_holding_registers = prepare_register(
-        register=CONFIG["registers"]["holdingRegister"],
+        register=register_config["holdingRegister"],
         init_type="word",
-        initialize_undefined_registers=CONFIG["registers"]["initializeUndefinedRegisters"],
+        initialize_undefined_registers=initialize_undefined_registers,
     )
     configured_input_registers = prepare_register(
-        register=CONFIG["registers"]["inputRegister"],
+        register=register_config["inputRegister"],
         init_type="word",
-        initialize_undefined_registers=CONFIG["registers"]["initializeUndefinedRegisters"],
+        initialize_undefined_registers=initialize_undefined_registers,
     )
 
     # add TCP protocol to configuration if not defined
-    if "protocol" not in CONFIG["server"]:
-        CONFIG["server"]["protocol"] = "TCP"
+    if "protocol" not in server_config:
+        server_config["protocol"] = "TCP"
 
     # try to get the interface IP address
     local_ip_addr = get_ip_address()
     if local_ip_addr != "":
-        log.info(f"Outbound device IP address is: {local_ip_addr}")
+        log.info("Outbound device IP address is: %s", local_ip_addr)
     run_server(
-        listener_address=CONFIG["server"]["listenerAddress"],
-        listener_port=CONFIG["server"]["listenerPort"],
-        protocol=CONFIG["server"]["protocol"],
-        tls_cert=CONFIG["server"]["tlsParams"]["privateKey"],
-        tls_key=CONFIG["server"]["tlsParams"]["certificate"],
-        zero_mode=CONFIG["registers"]["zeroMode"],
+        listener_address=server_config["listenerAddress"],
+        listener_port=server_config["listenerPort"],
+        protocol=server_config["protocol"],
+        tls_cert=server_config["tlsParams"]["certificate"],
+        tls_key=server_config["tlsParams"]["privateKey"],
+        zero_mode=register_config["zeroMode"],
         discrete_inputs=configured_discrete_inputs,
         coils=configured_coils,
         holding_registers=configured_holding_registers,
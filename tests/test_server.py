@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from src.app.modbus_server import prepare_register
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSparseDataBlock
+
+from src.app.modbus_server import create_datablock, prepare_register
 
 
 def test_prepare_register():
@@ -21,11 +23,64 @@ def test_prepare_register():
     full_register = prepare_register(
         register=register_example_data, init_type="word", initialize_undefined_registers=True
     )
+    assert isinstance(full_register, list)
     for key in register:
         assert register[key] == full_register[key]
     assert full_register[10] == 0
     assert len(full_register) == 65536
 
+    # malformed and out of range values are skipped
+    register = prepare_register(
+        register={"1": "0xZZ", "2": "0x10000", "3": 65536, "4": "0XCC04"},
+        init_type="word",
+        initialize_undefined_registers=False,
+    )
+    assert register == {4: 0xCC04}
+
+    # a malformed value does not overwrite a valid value of the same address
+    register = prepare_register(
+        register={"5": "0x0005", "0x5": 70000}, init_type="word", initialize_undefined_registers=False
+    )
+    assert register == {5: 5}
+    full_register = prepare_register(
+        register={"5": "0x0005", "0x5": 70000}, init_type="word", initialize_undefined_registers=True
+    )
+    assert full_register[5] == 5
+
+    # boolean registers accept booleans and integers
+    register = prepare_register(
+        register={"1": True, "2": 0, "3": 5, "4": "true"},
+        init_type="boolean",
+        initialize_undefined_registers=False,
+    )
+    assert register == {1: True, 2: False, 3: True}
+
+
+def test_create_datablock():
+    # no register definition results in a zero initialized sequential datablock
+    block = create_datablock(register=None)
+    assert isinstance(block, ModbusSequentialDataBlock)
+    assert block.getValues(0, 3) == [0, 0, 0]
+
+    # sparse register definition
+    block = create_datablock(register={1: 0xCC01, 3: 0xCC03})
+    assert isinstance(block, ModbusSparseDataBlock)
+    assert block.getValues(3, 1) == [0xCC03]
+    assert not block.validate(2, 1)
+
+    # register definition covering the whole address space
+    full_register = prepare_register(register={"1": "0xCC01"}, init_type="word", initialize_undefined_registers=True)
+    block = create_datablock(register=full_register)
+    assert isinstance(block, ModbusSequentialDataBlock)
+    assert block.getValues(0, 3) == [0, 0xCC01, 0]
+    assert block.validate(65535, 1)
+
+    dense_register = dict.fromkeys(range(0, 65536), 0)
+    dense_register[2] = 0xCC02
+    block = create_datablock(register=dense_register)
+    assert isinstance(block, ModbusSequentialDataBlock)
+    assert block.getValues(1, 2) == [0, 0xCC02]
+
 
 # def test_server():
 #     run_server()